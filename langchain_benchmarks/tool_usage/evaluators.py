@@ -5,16 +5,27 @@ Requirements:
 * Agents must output "intermediate_steps" in their run outputs.
 * The dataset must have "expected_steps" in its outputs.
 """
+import asyncio
+import contextvars
+import operator
 import re
-from typing import Any, Literal, Optional, Union
+from collections import Counter
+from typing import Any, Dict, List, Literal, Optional, Set, Tuple, Type, Union
+from uuid import UUID
 
+import openai
 from langchain.callbacks.manager import collect_runs
 from langchain.chains import LLMChain
 from langchain.evaluation import EvaluatorType, StringEvaluator, load_evaluator
 from langchain.evaluation.schema import StringEvaluator
 from langchain.smith import RunEvalConfig
 from langchain_core.language_models import BaseChatModel, BaseLanguageModel
+from langchain_core.runnables import Runnable
+from langchain_core.tracers import LangChainTracer
+from langchain_core.tracers.run_collector import RunCollectorCallbackHandler
 from langchain_openai import ChatOpenAI
+from langsmith import run_helpers
+from langsmith import utils as ls_utils
 from langsmith.evaluation.evaluator import (
     EvaluationResult,
     EvaluationResults,
@@ -25,6 +36,21 @@ from langsmith.schemas import Example, Run
 from langchain_benchmarks.tool_usage.prompts import (
     QA_TEMPLATE_FOR_MULTIVERSE_MATH,
     QA_TEMPLATE_FOR_MULTIVERSE_MATH_WITHOUT_QUESTION,
+    QA_TEMPLATE_FOR_MULTIVERSE_MATH_WITHOUT_QUESTION_BATCHED,
+)
+
+# Matches one verdict per line of a batched grading response, e.g. "2: CORRECT"
+_VERDICT_RE = re.compile(
+    r"^\s*(\d+)\s*[:.\-]\s*(CORRECT|INCORRECT)", re.MULTILINE | re.IGNORECASE
+)
+
+# Errors of the OpenAI client worth retrying a grading call on. Anything else,
+# like an invalid API key or a bad request, would only fail again.
+_TRANSIENT_ERRORS: Tuple[Type[BaseException], ...] = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
 )
 
 OutputEvaluation = Literal["qa", "qa_math", "none", "qa_math_without_question"]
@@ -33,9 +59,37 @@ OutputEvaluation = Literal["qa", "qa_math", "none", "qa_math_without_question"]
 class QAMathEvaluator(StringEvaluator):
     """An LLM-based relevance evaluator."""
 
-    def __init__(self, chat_model: BaseChatModel) -> None:
-        """Initialize the evaluator."""
-        self.eval_chain = QA_TEMPLATE_FOR_MULTIVERSE_MATH_WITHOUT_QUESTION | chat_model
+    def __init__(
+        self,
+        chat_model: BaseChatModel,
+        *,
+        max_concurrency: Optional[int] = None,
+        max_attempts: int = 3,
+        retry_if_exception_type: Tuple[Type[BaseException], ...] = _TRANSIENT_ERRORS,
+    ) -> None:
+        """Initialize the evaluator.
+
+        Args:
+            chat_model: The chat model used to grade the prediction.
+            max_concurrency: The maximum number of in-flight async grading calls.
+                None means no limit beyond the one imposed by the caller.
+            max_attempts: The number of attempts made for each grading call,
+                with exponential backoff between attempts.
+            retry_if_exception_type: The errors a grading call is retried on.
+                Defaults to the transient errors of the OpenAI client.
+        """
+        self.eval_chain = (
+            QA_TEMPLATE_FOR_MULTIVERSE_MATH_WITHOUT_QUESTION | chat_model
+        ).with_retry(
+            retry_if_exception_type=retry_if_exception_type,
+            stop_after_attempt=max_attempts,
+            wait_exponential_jitter=True,
+        )
+        self.max_concurrency = max_concurrency
+        # Semaphores are bound to the event loop they are first used in,
+        # so keep track of the loop and re-create it if it changes.
+        self._semaphore: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]]
+        self._semaphore = None
 
     @property
     def evaluation_name(self) -> str:
@@ -50,6 +104,22 @@ class QAMathEvaluator(StringEvaluator):
     def requires_input(self) -> bool:
         return False
 
+    @staticmethod
+    def _parse_result(result: Any) -> dict:
+        """Turn the response of the grading model into a score."""
+        # Slice before upper-casing so long responses aren't copied in full.
+        if result.content[:7].upper() == "CORRECT":
+            return {"score": 1}
+        else:
+            return {"score": 0}
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Get the semaphore guarding grading calls on the running loop."""
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore[0] is not loop:
+            self._semaphore = (loop, asyncio.Semaphore(self.max_concurrency))
+        return self._semaphore[1]
+
     def _evaluate_strings(
         self,
         prediction: str,
@@ -61,27 +131,282 @@ class QAMathEvaluator(StringEvaluator):
         result = self.eval_chain.invoke(
             {"answer": reference, "result": prediction}, **kwargs
         )
-        if result.content.startswith("CORRECT"):
-            return {"score": 1}
+        return self._parse_result(result)
+
+    async def _aevaluate_strings(
+        self,
+        prediction: str,
+        input: Optional[str] = None,
+        reference: Optional[str] = None,
+        **kwargs: Any,
+    ) -> dict:
+        """Asynchronously evaluate the prediction against the reference."""
+        chain_input = {"answer": reference, "result": prediction}
+        if self.max_concurrency is None:
+            result = await self.eval_chain.ainvoke(chain_input, **kwargs)
         else:
-            return {"score": 0}
+            async with self._get_semaphore():
+                result = await self.eval_chain.ainvoke(chain_input, **kwargs)
+        return self._parse_result(result)
 
 
-def compare_outputs(
-    run_outputs: dict,
-    example_outputs: dict,
-    run_inputs: dict,
-    *,
-    qa_evaluator: Optional[StringEvaluator] = None,
-) -> EvaluationResults:
-    """Compare the outputs of a run to the expected outputs."""
+class BatchedQAMathEvaluator(QAMathEvaluator):
+    """A QAMathEvaluator that grades concurrent async evaluations in batches.
+
+    Pending async evaluations are buffered and flushed to the grading model as a
+    single prompt once `max_batch_size` of them are waiting or `max_wait_seconds`
+    have passed since the first one was buffered, whichever happens first.
+
+    Evaluations are only batched together if they are traced to the same project
+    with the same client for the same experiment, so one evaluator can be shared
+    by several experiments.
+
+    The synchronous API grades one prediction at a time, like QAMathEvaluator.
+    """
+
+    def __init__(
+        self,
+        chat_model: BaseChatModel,
+        *,
+        max_batch_size: int = 10,
+        max_wait_seconds: float = 0.1,
+        max_concurrency: Optional[int] = None,
+        max_attempts: int = 3,
+        retry_if_exception_type: Tuple[Type[BaseException], ...] = _TRANSIENT_ERRORS,
+    ) -> None:
+        """Initialize the evaluator.
+
+        Args:
+            chat_model: The chat model used to grade the predictions.
+            max_batch_size: The maximum number of predictions graded in one call.
+            max_wait_seconds: How long to wait for a batch to fill up before
+                grading whatever has been queued so far.
+            max_concurrency: The maximum number of in-flight async grading calls
+                (each one grading a batch). None means no limit.
+            max_attempts: The number of attempts made for each grading call,
+                with exponential backoff between attempts.
+            retry_if_exception_type: The errors a grading call is retried on.
+                Defaults to the transient errors of the OpenAI client.
+        """
+        super().__init__(
+            chat_model,
+            max_concurrency=max_concurrency,
+            max_attempts=max_attempts,
+            retry_if_exception_type=retry_if_exception_type,
+        )
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.batch_eval_chain = (
+            QA_TEMPLATE_FOR_MULTIVERSE_MATH_WITHOUT_QUESTION_BATCHED | chat_model
+        ).with_retry(
+            retry_if_exception_type=retry_if_exception_type,
+            stop_after_attempt=max_attempts,
+            wait_exponential_jitter=True,
+        )
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        # Evaluations waiting for their batch to be flushed, keyed by batch,
+        # along with the loop they are waiting on, the timers that flush them and
+        # the tracing context each batch is traced with.
+        self._pending: Dict[Tuple[Any, ...], List[Tuple[str, str, asyncio.Future]]]
+        self._pending = {}
+        self._pending_tracing: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+        self._pending_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._flush_handles: Dict[Tuple[Any, ...], asyncio.TimerHandle] = {}
+        # Keep references to the running tasks so they are not garbage collected.
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def evaluation_name(self) -> str:
+        """Return the name of the evaluator."""
+        return "BatchedQAMathEvaluator"
+
+    def _spawn(self, coro: Any) -> None:
+        """Run the coroutine in the background outside the caller's context.
+
+        A fresh context keeps the grading calls from being traced as children of
+        whichever evaluation happened to trigger them. The tracing settings are
+        restored by `_grade_batch`.
+        """
+        task = contextvars.Context().run(asyncio.ensure_future, coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    def _get_batch_key(tracing: Dict[str, Any]) -> Tuple[Any, ...]:
+        """Get the key of the batch joined by an evaluation in the tracing context."""
+        metadata = tracing.get("metadata") or {}
+        return (
+            tracing.get("enabled"),
+            tracing.get("project_name"),
+            id(tracing.get("client")),
+            metadata.get("experiment"),
+        )
+
+    @staticmethod
+    def _merge_tracing(
+        batch_tracing: Dict[str, Any], tracing: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Keep only the metadata of the batch shared with another evaluation.
+
+        A batch grades several examples, so the metadata specific to one of them,
+        such as the id of its example, doesn't apply to the batch.
+        """
+        metadata = tracing.get("metadata") or {}
+        return {
+            **batch_tracing,
+            "metadata": {
+                k: v
+                for k, v in (batch_tracing.get("metadata") or {}).items()
+                if k in metadata and metadata[k] == v
+            },
+        }
+
+    def _flush(self, key: Tuple[Any, ...]) -> None:
+        """Grade all the pending evaluations of the given batch as one batch."""
+        flush_handle = self._flush_handles.pop(key, None)
+        if flush_handle is not None:
+            flush_handle.cancel()
+        batch = self._pending.pop(key, [])
+        tracing = self._pending_tracing.pop(key, {})
+        if batch:
+            self._spawn(self._grade_batch(batch, tracing))
+
+    async def _ainvoke_traced(
+        self, chain: Runnable, chain_input: dict, tracing: Dict[str, Any]
+    ) -> Tuple[Any, UUID]:
+        """Invoke the chain and return its output along with its run id."""
+        collector = RunCollectorCallbackHandler()
+        callbacks: List[Any] = [collector]
+        # This is called within the restored tracing context.
+        if ls_utils.tracing_is_enabled() is True:
+            # Without a parent run, LangChain would trace to the project and
+            # client from the environment rather than the ones of the context,
+            # and without the metadata of the context.
+            # Older versions of langsmith don't keep a client in the context.
+            callbacks.append(
+                LangChainTracer(
+                    project_name=tracing.get("project_name"),
+                    client=tracing.get("client"),
+                )
+            )
+        config = {"callbacks": callbacks, "metadata": tracing.get("metadata") or {}}
+        if self.max_concurrency is None:
+            result = await chain.ainvoke(chain_input, config=config)
+        else:
+            async with self._get_semaphore():
+                result = await chain.ainvoke(chain_input, config=config)
+        return result, collector.traced_runs[0].id
+
+    async def _grade_batch(
+        self, batch: List[Tuple[str, str, asyncio.Future]], tracing: Dict[str, Any]
+    ) -> None:
+        """Grade a batch of evaluations and resolve their futures.
+
+        The grading runs are traced with the given tracing context of the callers,
+        but without a parent run.
+        """
+        tracing = {**tracing, "parent": None}
+        try:
+            with run_helpers.tracing_context(**tracing):
+                await self._grade_batch_in_context(batch, tracing)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def _grade_batch_in_context(
+        self, batch: List[Tuple[str, str, asyncio.Future]], tracing: Dict[str, Any]
+    ) -> None:
+        """Grade a batch of evaluations within the restored tracing context."""
+        pairs = "\n".join(
+            f"{i}. INPUT_A: {reference}\n   INPUT_B: {prediction}"
+            for i, (reference, prediction, _) in enumerate(batch, 1)
+        )
+        result, run_id = await self._ainvoke_traced(
+            self.batch_eval_chain, {"pairs": pairs}, tracing
+        )
+        verdicts = {int(i): v for i, v in _VERDICT_RE.findall(result.content)}
+        for i, (reference, prediction, future) in enumerate(batch, 1):
+            if future.done():
+                continue
+            if i in verdicts:
+                score = int(verdicts[i].upper() == "CORRECT")
+                future.set_result({"score": score, "source_run_id": run_id})
+            else:
+                # The model skipped this pair, so grade it on its own.
+                result, row_run_id = await self._ainvoke_traced(
+                    self.eval_chain,
+                    {"answer": reference, "result": prediction},
+                    tracing,
+                )
+                future.set_result(
+                    {**self._parse_result(result), "source_run_id": row_run_id}
+                )
+
+    async def _aevaluate_strings(
+        self,
+        prediction: str,
+        input: Optional[str] = None,
+        reference: Optional[str] = None,
+        **kwargs: Any,
+    ) -> dict:
+        """Queue the prediction and wait for its batch to be graded.
+
+        The result contains the id of the grading run as `source_run_id`,
+        since the grading happens outside of the caller's context.
+        """
+        if kwargs:
+            # Per call configuration cannot be shared across a batch.
+            return await super()._aevaluate_strings(
+                prediction, input=input, reference=reference, **kwargs
+            )
+        loop = asyncio.get_running_loop()
+        if self._pending_loop is not loop:
+            # Anything left over from a previous loop can never be graded.
+            self._pending, self._flush_handles = {}, {}
+            self._pending_tracing = {}
+            self._pending_loop = loop
+        future = loop.create_future()
+        tracing = run_helpers.get_tracing_context()
+        key = self._get_batch_key(tracing)
+        batch = self._pending.setdefault(key, [])
+        if batch:
+            self._pending_tracing[key] = self._merge_tracing(
+                self._pending_tracing[key], tracing
+            )
+        else:
+            self._pending_tracing[key] = tracing
+        batch.append((reference, prediction, future))
+        if len(batch) >= self.max_batch_size:
+            self._flush(key)
+        elif key not in self._flush_handles:
+            self._flush_handles[key] = loop.call_later(
+                self.max_wait_seconds, self._flush, key
+            )
+        return await future
+
+
+def _compare_trajectory(
+    run_outputs: dict, example_outputs: dict
+) -> Tuple[int, List[EvaluationResult]]:
+    """Score the tools used by the run against the expected trajectory.
+
+    Returns:
+        The trajectory score along with all the trajectory and state results.
+    """
     if "intermediate_steps" in run_outputs:
         intermediate_steps = run_outputs["intermediate_steps"]
         # Since we are comparing to the tool names, we now need to get that
         # Intermediate steps is a Tuple[AgentAction, Any]
         # The first element is the action taken
         # The second element is the observation from taking that action
-        actual_steps = [action.tool for action, _ in intermediate_steps]
+        actual_steps = list(
+            map(
+                operator.attrgetter("tool"),
+                map(operator.itemgetter(0), intermediate_steps),
+            )
+        )
     elif "actual_steps" in run_outputs:
         actual_steps = run_outputs["actual_steps"]
     else:
@@ -92,16 +417,18 @@ def compare_outputs(
 
     expected_steps = example_outputs["expected_steps"]
 
+    # Look up the optional fields once
     order_matters = example_outputs.get("order_matters", True)
+    has_state = "state" in run_outputs and "state" in example_outputs
 
     if order_matters:
         # If the order matters trajectory must be the same as expected trajectory
         trajectory_score = int(actual_steps == expected_steps)
     else:
-        # If order does not matter, then we compare the trajectories after sorting
-        # them. This will make sure that the number of times each tool is used
+        # If order does not matter, then we compare how many times each tool is
+        # used. This will make sure that the number of times each tool is used
         # is the same, but the order does not matter.
-        trajectory_score = int(sorted(actual_steps) == sorted(expected_steps))
+        trajectory_score = int(Counter(actual_steps) == Counter(expected_steps))
 
     # Just score it based on whether it is correct or not
     step_fraction = len(actual_steps) / len(expected_steps)
@@ -121,37 +448,113 @@ def compare_outputs(
 
     # Evaluate state score
     # This will need to be evolved it's too simple.
-    if "state" in run_outputs and "state" in example_outputs:
-        state = run_outputs["state"]
-        example_state = example_outputs["state"]
+    if has_state:
         results.append(
             EvaluationResult(
                 key="Correct Final State",
-                score=int(state == example_state),
+                score=int(run_outputs["state"] == example_outputs["state"]),
             )
         )
 
-    if "output" in run_outputs and qa_evaluator:
-        output = run_outputs["output"]
+    return trajectory_score, results
+
+
+def _should_grade_output(
+    run_outputs: dict,
+    qa_evaluator: Optional[StringEvaluator],
+    trajectory_score: int,
+    skip_qa_on_bad_trajectory: bool,
+) -> bool:
+    """Whether the output of the run should be graded with the QA evaluator."""
+    return (
+        "output" in run_outputs
+        and qa_evaluator is not None
+        and (not skip_qa_on_bad_trajectory or bool(trajectory_score))
+    )
+
+
+def _get_qa_kwargs(
+    qa_evaluator: StringEvaluator,
+    run_outputs: dict,
+    example_outputs: dict,
+    run_inputs: dict,
+) -> Dict[str, Any]:
+    """Get the arguments for grading the output with the QA evaluator."""
+    qa_kwargs = {
+        "prediction": run_outputs["output"],
+        "reference": example_outputs["reference"],
+    }
+    if not isinstance(qa_evaluator, QAMathEvaluator):
+        qa_kwargs["input"] = run_inputs["question"]
+    return qa_kwargs
+
+
+def _get_correctness_result(
+    qa_results: dict, cb: RunCollectorCallbackHandler
+) -> EvaluationResult:
+    """Get the correctness result from the results of the QA evaluator."""
+    # Batched evaluators grade outside of the caller's context, so they report
+    # the grading run themselves.
+    source_run_id = qa_results.get("source_run_id") or cb.traced_runs[0].id
+    return EvaluationResult(
+        key="correctness",
+        score=qa_results["score"],
+        source_run_id=source_run_id,
+    )
+
+
+def compare_outputs(
+    run_outputs: dict,
+    example_outputs: dict,
+    run_inputs: dict,
+    *,
+    qa_evaluator: Optional[StringEvaluator] = None,
+    skip_qa_on_bad_trajectory: bool = False,
+) -> EvaluationResults:
+    """Compare the outputs of a run to the expected outputs.
+
+    If `skip_qa_on_bad_trajectory` is True, the output is only graded when the
+    trajectory is correct, and no correctness result is reported otherwise.
+    """
+    trajectory_score, results = _compare_trajectory(run_outputs, example_outputs)
+
+    if _should_grade_output(
+        run_outputs, qa_evaluator, trajectory_score, skip_qa_on_bad_trajectory
+    ):
+        qa_kwargs = _get_qa_kwargs(
+            qa_evaluator, run_outputs, example_outputs, run_inputs
+        )
         with collect_runs() as cb:
-            if isinstance(qa_evaluator, QAMathEvaluator):
-                qa_results = qa_evaluator.evaluate_strings(
-                    prediction=output,
-                    reference=example_outputs["reference"],
-                )
-            else:
-                qa_results = qa_evaluator.evaluate_strings(
-                    prediction=output,
-                    reference=example_outputs["reference"],
-                    input=run_inputs["question"],
-                )
-        results.append(
-            EvaluationResult(
-                key="correctness",
-                score=qa_results["score"],
-                source_run_id=cb.traced_runs[0].id,
-            )
+            qa_results = qa_evaluator.evaluate_strings(**qa_kwargs)
+        results.append(_get_correctness_result(qa_results, cb))
+
+    return {"results": results}
+
+
+async def acompare_outputs(
+    run_outputs: dict,
+    example_outputs: dict,
+    run_inputs: dict,
+    *,
+    qa_evaluator: Optional[StringEvaluator] = None,
+    skip_qa_on_bad_trajectory: bool = False,
+) -> EvaluationResults:
+    """Asynchronously compare the outputs of a run to the expected outputs.
+
+    Same as `compare_outputs`, but grades the output with the QA evaluator
+    without blocking, so that many examples can be graded concurrently.
+    """
+    trajectory_score, results = _compare_trajectory(run_outputs, example_outputs)
+
+    if _should_grade_output(
+        run_outputs, qa_evaluator, trajectory_score, skip_qa_on_bad_trajectory
+    ):
+        qa_kwargs = _get_qa_kwargs(
+            qa_evaluator, run_outputs, example_outputs, run_inputs
         )
+        with collect_runs() as cb:
+            qa_results = await qa_evaluator.aevaluate_strings(**qa_kwargs)
+        results.append(_get_correctness_result(qa_results, cb))
 
     return {"results": results}
 
@@ -163,6 +566,9 @@ class AgentTrajectoryEvaluator(RunEvaluator):
         self,
         eval_llm: Union[BaseLanguageModel, BaseChatModel, None] = None,
         output_evaluation: Literal["qa", "none", "qa_math"] = "qa",
+        max_concurrency: Optional[int] = None,
+        max_batch_size: Optional[int] = None,
+        skip_qa_on_bad_trajectory: bool = False,
     ) -> None:
         """Initialize the evaluator."""
         if output_evaluation == "none":
@@ -175,7 +581,7 @@ class AgentTrajectoryEvaluator(RunEvaluator):
             eval_llm = eval_llm or ChatOpenAI(
                 model="gpt-4",
                 temperature=0,
-                model_kwargs={"seed": 42},
+                seed=42,
                 max_retries=1,
                 request_timeout=60,
             )
@@ -188,7 +594,16 @@ class AgentTrajectoryEvaluator(RunEvaluator):
                     prompt=QA_TEMPLATE_FOR_MULTIVERSE_MATH,
                 )
             elif output_evaluation == "qa_math_without_question":
-                qa_evaluator = QAMathEvaluator(eval_llm)
+                if max_batch_size is None:
+                    qa_evaluator = QAMathEvaluator(
+                        eval_llm, max_concurrency=max_concurrency
+                    )
+                else:
+                    qa_evaluator = BatchedQAMathEvaluator(
+                        eval_llm,
+                        max_batch_size=max_batch_size,
+                        max_concurrency=max_concurrency,
+                    )
             else:
                 raise ValueError(
                     f"output_evaluation must be one of 'qa' or 'none', "
@@ -197,10 +612,10 @@ class AgentTrajectoryEvaluator(RunEvaluator):
 
         self.qa_evaluator = qa_evaluator
         self.output_evaluation = output_evaluation
+        self.skip_qa_on_bad_trajectory = skip_qa_on_bad_trajectory
 
-    def evaluate_run(
-        self, run: Run, example: Optional[Example] = None
-    ) -> EvaluationResults:
+    def _validate_run(self, run: Run, example: Optional[Example]) -> None:
+        """Check that the run and example can be scored."""
         # The run is the run from the agent
         if run.outputs is None:
             raise ValueError("Run outputs cannot be None")
@@ -223,11 +638,28 @@ class AgentTrajectoryEvaluator(RunEvaluator):
                 "Please make sure that your dataset contains 'expected_steps'"
             )
 
+    def evaluate_run(
+        self, run: Run, example: Optional[Example] = None
+    ) -> EvaluationResults:
+        self._validate_run(run, example)
         return compare_outputs(
             run.outputs,
             example.outputs,
             qa_evaluator=self.qa_evaluator,
             run_inputs=run.inputs,
+            skip_qa_on_bad_trajectory=self.skip_qa_on_bad_trajectory,
+        )
+
+    async def aevaluate_run(
+        self, run: Run, example: Optional[Example] = None
+    ) -> EvaluationResults:
+        self._validate_run(run, example)
+        return await acompare_outputs(
+            run.outputs,
+            example.outputs,
+            qa_evaluator=self.qa_evaluator,
+            run_inputs=run.inputs,
+            skip_qa_on_bad_trajectory=self.skip_qa_on_bad_trajectory,
         )
 
 
@@ -235,6 +667,9 @@ def get_eval_config(
     *,
     eval_llm: Union[BaseLanguageModel, BaseChatModel, None] = None,
     output_evaluation: OutputEvaluation = "qa",
+    max_concurrency: Optional[int] = None,
+    max_batch_size: Optional[int] = None,
+    skip_qa_on_bad_trajectory: bool = False,
 ) -> RunEvalConfig:
     """Get the default evaluator for the environment.
 
@@ -247,6 +682,13 @@ def get_eval_config(
             - 'none' will not evaluate the output of the agent -- in some cases
               it's only relevant to evaluate how the agent used tools, not what
               its output.
+        max_concurrency: the maximum number of concurrent async grading calls
+            made by the 'qa_math_without_question' evaluator. None means no limit.
+        max_batch_size: if set, the 'qa_math_without_question' evaluator grades
+            up to this many concurrent async evaluations in a single call.
+        skip_qa_on_bad_trajectory: if True, the output is only graded for runs
+            whose trajectory is correct. The aggregate correctness is then
+            conditional on the trajectory being correct.
 
     Returns:
         A RunEvalConfig that can be used to evaluate the environment
@@ -254,7 +696,11 @@ def get_eval_config(
     return RunEvalConfig(
         custom_evaluators=[
             AgentTrajectoryEvaluator(
-                eval_llm=eval_llm, output_evaluation=output_evaluation
+                eval_llm=eval_llm,
+                output_evaluation=output_evaluation,
+                max_concurrency=max_concurrency,
+                max_batch_size=max_batch_size,
+                skip_qa_on_bad_trajectory=skip_qa_on_bad_trajectory,
             )
         ]
     )
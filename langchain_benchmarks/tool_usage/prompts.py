@@ -47,3 +47,31 @@ COMPARISON:"""
 QA_TEMPLATE_FOR_MULTIVERSE_MATH_WITHOUT_QUESTION = PromptTemplate(
     input_variables=["result", "answer"], template=MATH_TEMPLATE_NO_QUESTION
 )
+
+MATH_TEMPLATE_NO_QUESTION_BATCHED = """\
+Compare each numbered pair of INPUT_A and INPUT_B and determine whether the numeric result in them is the same.
+
+For every pair, reply on its own line with the number of the pair followed by CORRECT if the result is the same, or INCORRECT if the result is different.
+
+Example Format:
+1. INPUT_A: input_a here
+   INPUT_B: input_b here
+2. INPUT_A: input_a here
+   INPUT_B: input_b here
+COMPARISON:
+1: CORRECT or INCORRECT here
+2: CORRECT or INCORRECT here
+
+Ignore differences in punctuation and phrasing between the student answer and true answer, please only compare the first 4 decimal digits.
+
+For instance if INPUT_A = 123.6751345 and INPUT_B = 123.6751456 you should return CORRECT, since the first 4 decimal points match.
+
+Begin!
+
+{pairs}
+COMPARISON:"""
+
+# Version without the query that grades several results at once
+QA_TEMPLATE_FOR_MULTIVERSE_MATH_WITHOUT_QUESTION_BATCHED = PromptTemplate(
+    input_variables=["pairs"], template=MATH_TEMPLATE_NO_QUESTION_BATCHED
+)
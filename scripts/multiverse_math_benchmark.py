@@ -1,17 +1,28 @@
+import asyncio
 import datetime
+import functools
+import hashlib
+import itertools
+import os
+import pickle
 import sys
+import tempfile
+import time
 import uuid
+from pathlib import Path
 
-from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage
+from langchain_core.messages import SystemMessage
 from langchain_core.messages.utils import convert_to_messages
 from langsmith.client import Client
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from langchain_benchmarks import __version__
 
 sys.path.append("./../langchain_benchmarks")
 from langchain.agents import AgentExecutor, create_tool_calling_agent
 from langchain.chat_models import init_chat_model
-from langsmith.evaluation import evaluate
+from langsmith.evaluation import aevaluate
 from tool_usage.tasks.multiverse_math import *
 
 tests = [
@@ -39,70 +50,170 @@ tests = [
     ("gpt-4o-mini", "openai"),
 ]
 
-client = Client()  # Launch langsmith client for cloning datasets
+# Launch langsmith client for cloning datasets and running the experiments,
+# retrying transient failures with exponential backoff.
+client = Client(
+    retry_config=Retry(
+        total=5,
+        backoff_factor=0.3,
+        status_forcelist=[408, 425, 429, 502, 503, 504],
+        allowed_methods=None,
+        raise_on_status=False,
+        respect_retry_after_header=True,
+    )
+)
+# All the concurrent experiments share this client. Older versions of langsmith
+# (such as the one in poetry.lock) leave it with a plain HTTPAdapter, which only
+# pools 10 connections and, since the session already has it, without the retry
+# config above. Newer versions mount their own adapter with a pool sized for the
+# client, so keep that one.
+if type(client.session.get_adapter("https://")) is HTTPAdapter:
+    _adapter = HTTPAdapter(
+        pool_connections=64, pool_maxsize=64, max_retries=client.retry_config
+    )
+    client.session.mount("http://", _adapter)
+    client.session.mount("https://", _adapter)
+
+# Prompts and few shot examples are the same for every model, so cache them on
+# disk to avoid fetching them from LangSmith every time the script is run.
+CACHE_DIR = Path.home() / ".cache" / "langchain_benchmarks"
+CACHE_TTL_SECONDS = 24 * 60 * 60
+
+
+def disk_cache(func):
+    """Cache the results of the function in memory and in CACHE_DIR.
+
+    Entries on disk are scoped to the LangSmith endpoint and workspace of the
+    client, so that switching either doesn't reuse another workspace's results.
+    If the workspace can't be determined, the disk cache is skipped.
+    """
+
+    @functools.lru_cache(maxsize=None)
+    @functools.wraps(func)
+    def wrapper(*args):
+        tenant_id = client._get_optional_tenant_id()
+        if tenant_id is None:
+            return func(*args)
+        key = hashlib.sha1(
+            repr((client.api_url, str(tenant_id), func.__name__, args)).encode()
+        ).hexdigest()
+        path = CACHE_DIR / f"{key}.pkl"
+        if path.exists() and time.time() - path.stat().st_mtime < CACHE_TTL_SECONDS:
+            try:
+                with path.open("rb") as f:
+                    return pickle.load(f)
+            except Exception:
+                # A corrupted entry, or one pickled by other versions of the
+                # libraries, is treated as a cache miss.
+                pass
+        result = func(*args)
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so that an interrupted run can't leave
+        # a truncated entry behind.
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(result, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return result
+
+    return wrapper
+
+
+@disk_cache
+def pull_prompt(prompt_identifier):
+    return client.pull_prompt(prompt_identifier)
+
+
+@disk_cache
+def list_examples(dataset_name):
+    return list(client.list_examples(dataset_name=dataset_name))
+
+
+def _filter_convert(raw_messages):
+    # The system prompt is dropped here, so all the few shot lists share the result
+    for m in convert_to_messages(raw_messages):
+        if type(m) is not SystemMessage:
+            yield m
 
 
 def get_few_shot_messages(task_name):
     if task_name == "Multiverse Math":
-        uncleaned_examples = [
-            e
-            for e in client.list_examples(
-                dataset_name="multiverse-math-examples-for-few-shot"
-            )
-        ]
         few_shot_messages = []
         few_shot_three_messages = []
         examples = []
-        for i in range(len(uncleaned_examples)):
-            converted_messages = convert_to_messages(
-                uncleaned_examples[i].outputs["output"]
-            )
+        for i, example in enumerate(
+            list_examples("multiverse-math-examples-for-few-shot")
+        ):
+            messages = list(_filter_convert(example.outputs["output"]))
             examples.append(
-                # The message at index 1 is the human message asking the actual math question (0th message is system prompt)
+                # With the system prompt dropped, the first message is the human message asking the actual math question
                 {
-                    "question": converted_messages[1].content,
-                    "messages": [
-                        m
-                        for m in converted_messages
-                        if isinstance(m, SystemMessage) == False
-                    ],
+                    "question": messages[0].content,
+                    "messages": messages,
                 }
             )
-            few_shot_messages += converted_messages
+            few_shot_messages += messages
             if i < 3:
-                few_shot_three_messages += converted_messages
+                few_shot_three_messages += messages
 
-        return (
-            examples,
-            [m for m in few_shot_messages if not isinstance(m, SystemMessage)],
-            [m for m in few_shot_three_messages if not isinstance(m, SystemMessage)],
-        )
+        return examples, few_shot_messages, few_shot_three_messages
     else:
         raise ValueError("Few shot messages not supported for this dataset")
 
 
+def _render_user(m):
+    return f"<|im_start|>user\n{m.content}\n<|im_end|>"
+
+
+def _render_tool(m):
+    return f"<|im_start|>tool\n{m.content}\n<|im_end|>"
+
+
+def _render_assistant(m):
+    return f"<|im_start|>assistant\n{m.content}\n<|im_end|>"
+
+
+_format_tool_input = "{0}:{1}".format
+
+
+def _render_assistant_toolcalls(m):
+    parts = ["<|im_start|>assistant"]
+    for tool_use in m.content:
+        if "name" in tool_use:
+            tool_input = ", ".join(
+                itertools.starmap(_format_tool_input, tool_use["input"].items())
+            )
+            parts.append(f"Use tool {tool_use['name']}, input: {tool_input}")
+        else:
+            parts.append(tool_use["text"])
+        parts.append("\n")
+    parts.append("\n<|im_end|>")
+    return "".join(parts)
+
+
+# Renderers keyed by the exact message class name, anything else is rendered as
+# an assistant message.
+_RENDERERS = {
+    "HumanMessage": _render_user,
+    "ToolMessage": _render_tool,
+    "AIMessage": _render_assistant,
+}
+
+
 def turn_messages_to_str(few_shot_messages):
-    few_shot_str = ""
+    parts = []
     for m in few_shot_messages:
-        if isinstance(m.content, list):
-            few_shot_str += "<|im_start|>assistant"
-            for tool_use in m.content:
-                if "name" in tool_use:
-                    few_shot_str += f"Use tool {tool_use['name']}, input: {', '.join(f'{k}:{v}' for k,v in tool_use['input'].items())}"
-                else:
-                    few_shot_str += tool_use["text"]
-                few_shot_str += "\n"
-            few_shot_str += "\n<|im_end|>"
+        if type(m.content) is list:
+            renderer = _render_assistant_toolcalls
         else:
-            if isinstance(m, HumanMessage):
-                few_shot_str += f"<|im_start|>user\n{m.content}\n<|im_end|>"
-            elif isinstance(m, ToolMessage):
-                few_shot_str += f"<|im_start|>tool\n{m.content}\n<|im_end|>"
-            else:
-                few_shot_str += f"<|im_start|>assistant\n{m.content}\n<|im_end|>"
-
-        few_shot_str += "\n"
-    return few_shot_str
+            renderer = _RENDERERS.get(type(m).__name__, _render_assistant)
+        parts.append(renderer(m))
+        parts.append("\n")
+    return "".join(parts)
 
 
 def get_few_shot_str_from_messages(few_shot_messages, few_shot_three_messages):
@@ -115,33 +226,34 @@ def get_prompts(task_name, **kwargs):
     if task_name == "Multiverse Math":
         return [
             (
-                client.pull_prompt("langchain-ai/multiverse-math-no-few-shot"),
+                pull_prompt("langchain-ai/multiverse-math-no-few-shot"),
                 "no-few-shot",
             ),
             (
-                client.pull_prompt("langchain-ai/multiverse-math-few-shot-messages"),
+                pull_prompt("langchain-ai/multiverse-math-few-shot-messages"),
                 "few-shot-messages",
             ),
             (
-                client.pull_prompt("langchain-ai/multiverse-math-few-shot-str"),
+                pull_prompt("langchain-ai/multiverse-math-few-shot-str"),
                 "few-shot-string",
             ),
             (
-                client.pull_prompt("langchain-ai/multiverse-math-few-shot-3-messages"),
+                pull_prompt("langchain-ai/multiverse-math-few-shot-3-messages"),
                 "few-shot-three-messages",
             ),
             (
-                client.pull_prompt("langchain-ai/multiverse-math-few-shot-3-str"),
+                pull_prompt("langchain-ai/multiverse-math-few-shot-3-str"),
                 "few-shot-three-strings",
             ),
         ]
 
 
-def predict_from_callable(callable, instructions):
-    def predict(run):
-        return callable.invoke(
-            {"question": run["question"], "instructions": instructions}
-        )
+def predict_from_callable(callable, instructions, semaphore):
+    async def predict(run):
+        async with semaphore:
+            return await callable.ainvoke(
+                {"question": run["question"], "instructions": instructions}
+            )
 
     return predict
 
@@ -163,30 +275,87 @@ prompts = get_prompts(
     few_shot_three_str=few_shot_three_str,
 )
 
-for model_name, model_provider in tests:
-    model = init_chat_model(model_name, model_provider=model_provider, temperature=0)
+# Number of examples evaluated at the same time within each experiment. The
+# workload is network bound, so raise this as far as the rate limits allow.
+eval_concurrency = int(os.getenv("EVAL_CONCURRENCY", "32"))
+# Number of grading calls in flight against the judge (gpt-4) across all
+# experiments. These OpenAI requests are not counted in OPENAI_CONCURRENCY.
+judge_concurrency = int(os.getenv("JUDGE_CONCURRENCY", "32"))
+# Number of agent runs in flight against each provider across all experiments,
+# so that one provider's rate limit doesn't hold back experiments on the other.
+# This only covers the agents, grading is capped by JUDGE_CONCURRENCY.
+provider_concurrency = {
+    "anthropic": int(os.getenv("ANTHROPIC_CONCURRENCY", "32")),
+    "openai": int(os.getenv("OPENAI_CONCURRENCY", "32")),
+}
 
-    print(f"Benchmarking {task.name} with model: {model_name}")
-    eval_config = task.get_eval_config()
 
-    for prompt, prompt_name in prompts:
-        tools = task.create_environment().tools
-        agent = create_tool_calling_agent(model, tools, prompt)
-        agent_executor = AgentExecutor(
-            agent=agent, tools=tools, return_intermediate_steps=True
-        )
+async def run_experiment(
+    semaphore, agent_executor, eval_config, model_name, prompt_name
+):
+    print(f"Benchmarking {task.name} with model: {model_name} ({prompt_name})")
+    await aevaluate(
+        predict_from_callable(agent_executor, task.instructions, semaphore),
+        data=dataset_name,
+        evaluators=eval_config.custom_evaluators,
+        max_concurrency=eval_concurrency,
+        client=client,
+        metadata={
+            "model": model_name,
+            "id": experiment_uuid,
+            "task": task.name,
+            "date": today,
+            "langchain_benchmarks_version": __version__,
+        },
+        experiment_prefix=f"{model_name}-{task.name}-{prompt_name}",
+    )
 
-        evaluate(
-            predict_from_callable(agent_executor, task.instructions),
-            data=dataset_name,
-            evaluators=eval_config.custom_evaluators,
-            max_concurrency=5,
-            metadata={
-                "model": model_name,
-                "id": experiment_uuid,
-                "task": task.name,
-                "date": today,
-                "langchain_benchmarks_version": __version__,
-            },
-            experiment_prefix=f"{model_name}-{task.name}-{prompt_name}",
+
+async def main():
+    semaphores = {
+        provider: asyncio.Semaphore(limit)
+        for provider, limit in provider_concurrency.items()
+    }
+    # The judge doesn't depend on the model being benchmarked, so all the
+    # experiments share one evaluator and with it one cap on grading calls.
+    eval_config = task.get_eval_config(max_concurrency=judge_concurrency)
+    experiments = []
+    experiment_names = []
+    for model_name, model_provider in tests:
+        model = init_chat_model(
+            model_name, model_provider=model_provider, temperature=0
         )
+        # The multiverse math tools are stateless, so the prompts can share them.
+        tools = task.create_environment().tools
+
+        for prompt, prompt_name in prompts:
+            agent = create_tool_calling_agent(model, tools, prompt)
+            agent_executor = AgentExecutor(
+                agent=agent, tools=tools, return_intermediate_steps=True
+            )
+            experiments.append(
+                run_experiment(
+                    semaphores[model_provider],
+                    agent_executor,
+                    eval_config,
+                    model_name,
+                    prompt_name,
+                )
+            )
+            experiment_names.append((model_name, prompt_name))
+
+    # Let the other experiments finish when one of them fails, rather than
+    # cancelling them and leaving them half done.
+    results = await asyncio.gather(*experiments, return_exceptions=True)
+    failures = [
+        (model_name, prompt_name, result)
+        for (model_name, prompt_name), result in zip(experiment_names, results)
+        if isinstance(result, BaseException)
+    ]
+    for model_name, prompt_name, error in failures:
+        print(f"Failed {task.name} with model: {model_name} ({prompt_name}): {error!r}")
+    if failures:
+        sys.exit(f"{len(failures)} of {len(experiments)} experiments failed")
+
+
+asyncio.run(main())
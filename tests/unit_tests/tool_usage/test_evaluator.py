@@ -1,9 +1,22 @@
 """Test the standard agent evaluator."""
+import asyncio
+from unittest import mock
 
+import openai
 import pytest
 from langchain.schema import AgentAction
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.runnables import RunnableLambda
+from langsmith import Client
+from langsmith.run_helpers import tracing_context
 
-from langchain_benchmarks.tool_usage.evaluators import compare_outputs
+from langchain_benchmarks.tool_usage.evaluators import (
+    AgentTrajectoryEvaluator,
+    BatchedQAMathEvaluator,
+    QAMathEvaluator,
+    acompare_outputs,
+    compare_outputs,
+)
 
 
 @pytest.mark.parametrize(
@@ -135,6 +148,21 @@ from langchain_benchmarks.tool_usage.evaluators import compare_outputs
                 "# steps / # expected steps": 1.0,
             },
         ),
+        # Using actual steps
+        # With order not mattering, but tools used a different number of times
+        (
+            {
+                "actual_steps": ["action_1", "action_1", "action_2"],
+            },
+            {
+                "expected_steps": ["action_2", "action_1", "action_2"],
+                "order_matters": False,
+            },
+            {
+                "Intermediate steps correctness": False,
+                "# steps / # expected steps": 1.0,
+            },
+        ),
     ],
 )
 def test_compare_outputs(run_outputs, example_outputs, expected_results):
@@ -143,3 +171,147 @@ def test_compare_outputs(run_outputs, example_outputs, expected_results):
     assert {
         result.key: result.score for result in evaluation_results["results"]
     } == expected_results
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "response, expected_score",
+    [("CORRECT", 1), ("Correct.", 1), ("INCORRECT", 0), ("WRONG", 0)],
+)
+async def test_acompare_outputs(response, expected_score):
+    """Test compare outputs asynchronously with a QA evaluator."""
+    qa_evaluator = QAMathEvaluator(
+        FakeListChatModel(responses=[response]), max_concurrency=1
+    )
+    evaluation_results = await acompare_outputs(
+        {"actual_steps": ["action_1"], "output": "3"},
+        {"expected_steps": ["action_1"], "reference": "3"},
+        run_inputs={},
+        qa_evaluator=qa_evaluator,
+    )
+    assert {result.key: result.score for result in evaluation_results["results"]} == {
+        "Intermediate steps correctness": 1,
+        "# steps / # expected steps": 1.0,
+        "correctness": expected_score,
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "responses, expected_scores",
+    [
+        (["1: CORRECT\n2: INCORRECT"], [1, 0]),
+        (["1. correct\n 2 - Incorrect"], [1, 0]),
+        # The second verdict is missing, so it's graded on its own
+        (["1: INCORRECT", "CORRECT"], [0, 1]),
+    ],
+)
+async def test_batched_qa_math_evaluator(responses, expected_scores):
+    """Test that concurrent evaluations are graded in a single batch."""
+    qa_evaluator = BatchedQAMathEvaluator(
+        FakeListChatModel(responses=responses), max_batch_size=2, max_wait_seconds=1
+    )
+    qa_results = await asyncio.gather(
+        qa_evaluator.aevaluate_strings(prediction="3", reference="3"),
+        qa_evaluator.aevaluate_strings(prediction="4", reference="5"),
+    )
+    assert [result["score"] for result in qa_results] == expected_scores
+    assert all(result["source_run_id"] is not None for result in qa_results)
+
+
+@pytest.mark.parametrize("trajectory, graded", [(["action_1"], True), ([], False)])
+def test_compare_outputs_skip_qa_on_bad_trajectory(trajectory, graded):
+    """Test that the output is only graded when the trajectory is correct."""
+    chat_model = FakeListChatModel(responses=["CORRECT", "CORRECT"])
+    evaluation_results = compare_outputs(
+        {"actual_steps": trajectory, "output": "3"},
+        {"expected_steps": ["action_1"], "reference": "3"},
+        run_inputs={},
+        qa_evaluator=QAMathEvaluator(chat_model),
+        skip_qa_on_bad_trajectory=True,
+    )
+    keys = {result.key for result in evaluation_results["results"]}
+    assert ("correctness" in keys) == graded
+    assert chat_model.i == int(graded)
+
+
+@pytest.mark.asyncio
+async def test_batched_qa_math_evaluator_tracing_context(monkeypatch):
+    """Test that batches are traced with the tracing context of the caller."""
+    client = mock.MagicMock(spec=Client)
+    # Older versions of langsmith can't set the client in the tracing context.
+    monkeypatch.setattr("langchain_core.tracers.langchain.get_client", lambda: client)
+    qa_evaluator = BatchedQAMathEvaluator(
+        FakeListChatModel(responses=["1: CORRECT\n2: CORRECT"]), max_batch_size=2
+    )
+    with tracing_context(enabled=True, project_name="evaluators"):
+        qa_results = await asyncio.gather(
+            qa_evaluator.aevaluate_strings(prediction="3", reference="3"),
+            qa_evaluator.aevaluate_strings(prediction="4", reference="4"),
+        )
+    created_runs = {
+        call.kwargs["id"]: call.kwargs["project_name"]
+        for call in client.create_run.call_args_list
+    }
+    assert created_runs[qa_results[0]["source_run_id"]] == "evaluators"
+    assert qa_results[0]["source_run_id"] == qa_results[1]["source_run_id"]
+
+
+@pytest.mark.asyncio
+async def test_batched_qa_math_evaluator_separates_experiments(monkeypatch):
+    """Test that evaluations of different experiments are never batched together."""
+    client = mock.MagicMock(spec=Client)
+    monkeypatch.setattr("langchain_core.tracers.langchain.get_client", lambda: client)
+    qa_evaluator = BatchedQAMathEvaluator(
+        FakeListChatModel(responses=["1: CORRECT\n2: CORRECT"]),
+        max_batch_size=2,
+        max_wait_seconds=0.01,
+    )
+
+    async def evaluate(experiment: str, example_id: str) -> dict:
+        metadata = {"experiment": experiment, "reference_example_id": example_id}
+        with tracing_context(
+            enabled=True, project_name="evaluators", metadata=metadata
+        ):
+            return await qa_evaluator.aevaluate_strings(prediction="3", reference="3")
+
+    qa_results = await asyncio.gather(
+        evaluate("a", "1"), evaluate("b", "2"), evaluate("a", "3")
+    )
+    assert qa_results[0]["source_run_id"] == qa_results[2]["source_run_id"]
+    assert qa_results[0]["source_run_id"] != qa_results[1]["source_run_id"]
+    created_runs = {
+        call.kwargs["id"]: call.kwargs["extra"]["metadata"]
+        for call in client.create_run.call_args_list
+    }
+    assert created_runs[qa_results[0]["source_run_id"]]["experiment"] == "a"
+    assert "reference_example_id" not in created_runs[qa_results[0]["source_run_id"]]
+    assert created_runs[qa_results[1]["source_run_id"]]["reference_example_id"] == "2"
+
+
+@pytest.mark.parametrize(
+    "error, expected_attempts",
+    [
+        (ValueError("bad prompt"), 1),
+        (openai.APIConnectionError(request=mock.MagicMock()), 2),
+    ],
+)
+def test_qa_math_evaluator_only_retries_transient_errors(error, expected_attempts):
+    """Test that grading calls are only retried on transient errors."""
+    attempts = []
+
+    def grade(prompt):
+        attempts.append(prompt)
+        raise error
+
+    qa_evaluator = QAMathEvaluator(RunnableLambda(grade), max_attempts=2)
+    with pytest.raises(type(error)):
+        qa_evaluator.evaluate_strings(prediction="3", reference="3")
+    assert len(attempts) == expected_attempts
+
+
+def test_default_eval_llm(monkeypatch):
+    """Test that the default grading model can be created."""
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    evaluator = AgentTrajectoryEvaluator(output_evaluation="qa_math_without_question")
+    assert evaluator.qa_evaluator is not None